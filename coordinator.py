@@ -1,6 +1,14 @@
-from messages import *
+from collections import Counter
+from messages import (FRAME_HEADER_SIZE, MAX_DATAGRAM_SIZE, GetWorkRequest, GetWorkResponse, Message,
+                      WorkCompleteRequest, WorkCompleteResponse)
+import os
 import random
-from socket import *
+import selectors
+from socket import (AF_INET, IPPROTO_TCP, SO_RCVBUF, SO_REUSEADDR, SO_SNDBUF,
+                    SOCK_DGRAM, SOCK_STREAM, SOL_SOCKET, SOMAXCONN, TCP_NODELAY,
+                    socket)
+import sys
+import threading
 
 # This class is fully implemented for you and you should not need to make any
 # modifications to it.
@@ -27,19 +35,22 @@ class WorkTracker:
         self.play_ids.append(1526)  # Twelfth Night
         self.play_ids.append(1515)  # Merchant of Venice
 
-        self.word_counts = dict()
+        self.word_counts = Counter()
         """
         A dictionary that maintains the aggregate word frequencies across the
         plays analyzed by Volunteers.
         key: word, value: count.
         """
 
-        self.unstarted_paths = set()
+        # Interned, so that paths parsed from WorkCompleteRequests (which are
+        # interned too) compare by identity in the set lookups.
+        paths = [sys.intern(f"/cache/epub/{i}/pg{i}.txt") for i in self.play_ids]
+        random.shuffle(paths)
+        self.unstarted_paths = paths
         """
-        Paths of plays that have not been assigned to any Volunteers yet.
+        Paths of plays that have not been assigned to any Volunteers yet,
+        shuffled so that they can be handed out from the end.
         """
-        for i in self.play_ids:
-            self.unstarted_paths.add("/cache/epub/%s/pg%s.txt" % (i, i))
 
         self.started_paths = set()
         """
@@ -47,6 +58,11 @@ class WorkTracker:
         yet reported results for them yet.
         """
 
+        self._started_list = []
+        """
+        The same paths as started_paths, as a list to pick from at random.
+        """
+
         self.finished_paths = set()
         """
         Paths of plays that have been analyzed by Volunteers and the reported
@@ -62,14 +78,14 @@ class WorkTracker:
 
         if len(self.unstarted_paths) > 0:
             # There are unstarted plays, so hand one of them out.
-            path = random.choice(list(self.unstarted_paths))
-            self.unstarted_paths.remove(path)
+            path = self.unstarted_paths.pop()
             self.started_paths.add(path)
+            self._started_list.append(path)
         elif len(self.started_paths) > 0:
             print("There are no unstarted paths.")
             print("So handing out an already started (but not finished) path.")
             print("Just in case the other volunteer flakes.")
-            path = random.choice(list(self.started_paths))
+            path = random.choice(self._started_list)
         else:
             # There's no work left.
             path = ""
@@ -82,13 +98,14 @@ class WorkTracker:
         analyzed plays.
         """
 
-        if path in self.finished_paths:
-            # This path has already been processed, so ignore it. Otherwise, it
-            # would be processed multiple times and skew the results.
+        if path not in self.started_paths:
+            # This path has already been processed (or was never handed out),
+            # so ignore it. Otherwise, it would be processed multiple times and
+            # skew the results.
             return
-        for [word, count] in word_counts.items():
-            self.word_counts[word] = self.word_counts.get(word, 0) + int(count)
+        self.word_counts.update(word_counts)
         self.started_paths.remove(path)
+        self._started_list.remove(path)
         self.finished_paths.add(path)
 
     def is_all_work_done(self) -> bool:
@@ -98,13 +115,41 @@ class WorkTracker:
 
         return len(self.finished_paths) == len(self.play_ids)
 
-    def get_word_counts_desc(self):
+    def get_word_counts_desc(self, top: int | None = None) -> dict:
         """
-        Returns the aggregate word-counts in descending order by count.
+        Returns the aggregate word-counts in descending order by count. If top
+        is specified, only returns that many of the most frequent words (which
+        avoids sorting all of them).
         """
 
-        return dict(sorted(self.word_counts.items(),
-                           key=lambda item: item[1], reverse=True))
+        return dict(self.word_counts.most_common(top))
+
+
+class _Connection:
+    """
+    The state the Coordinator keeps for a connected Volunteer, as the data of
+    its selector key.
+    """
+
+    __slots__ = ('received', 'unsent', 'done')
+
+    def __init__(self):
+        self.received = bytearray()
+        """
+        What the Volunteer has sent that hasn't been answered yet: the start of
+        a frame that hasn't fully arrived.
+        """
+
+        self.unsent = bytearray()
+        """
+        Responses that the Volunteer hasn't taken yet. Nothing more is read
+        from the Volunteer until they've all been sent.
+        """
+
+        self.done = False
+        """
+        Whether to close the connection once unsent is empty.
+        """
 
 
 class Coordinator:
@@ -127,6 +172,48 @@ class Coordinator:
         Server socket that speaks TCP (transport) and IPv4 (network)
         """
 
+        self.udp_socket = socket(family=AF_INET, type=SOCK_DGRAM)
+        """
+        Socket that answers GetWorkRequests sent as single UDP datagrams, bound
+        to the same port number as server_socket. Results are still reported
+        over TCP, since they don't fit in a datagram.
+        """
+
+        self._sel = selectors.DefaultSelector()
+        """
+        Selector (epoll/kqueue where available) that waits on the server
+        socket, the UDP socket, the wakeup pipe and every connected
+        Volunteer (whose key data is its _Connection).
+        """
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        """
+        Self-pipe that is written to once all the work is done (b'x'), or stop
+        is called (b's'), so that the selector loop wakes up and starts
+        winding down.
+        """
+
+        self._wakeup_lock = threading.Lock()
+        """
+        Keeps stop from writing to the self-pipe while (or after) it's closed.
+        """
+
+        self._wakeup_closed = False
+        """
+        Whether the self-pipe has been closed.
+        """
+
+        self.result_size = 100
+        """
+        Number of the most frequent words to print once all the work is done.
+        """
+
+        self.linger_timeout = .5
+        """
+        Seconds to keep telling Volunteers that there's no work left after all
+        the work is done, before shutting down once no one is connecting.
+        """
+
     def start(self, port: int) -> int:
         """
         Starts the coordinator server on the specified port. If the specified
@@ -134,15 +221,170 @@ class Coordinator:
         is listening on.
         """
 
+        self._listen(port)
+        while True:
+            tcp_port = self.server_socket.getsockname()[1]
+            try:
+                self.udp_socket.bind(('', tcp_port))
+                break
+            except OSError:
+                if port != 0: raise
+                # The port picked for TCP is taken for UDP, so pick another.
+                self.server_socket.close()
+                self.server_socket = socket(family=AF_INET, type=SOCK_STREAM)
+                self._listen(0)
+
+        self.server_socket.setblocking(False)
+        self.udp_socket.setblocking(False)
+        self._sel.register(self.server_socket, selectors.EVENT_READ)
+        self._sel.register(self.udp_socket, selectors.EVENT_READ)
+        self._sel.register(self._wakeup_r, selectors.EVENT_READ)
+        return tcp_port
+
+    def _listen(self, port: int):
+        """
+        Binds server_socket to the specified port (or an unused one, if 0) and
+        starts listening on it.
+        """
+
+        # Allow rebinding the port right after a restart, while connections
+        # from the previous run are still in TIME_WAIT.
+        self.server_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        # Accepted sockets inherit these, so large WorkCompleteRequests need
+        # fewer round trips.
+        self.server_socket.setsockopt(SOL_SOCKET, SO_RCVBUF, 256 * 1024)
+        self.server_socket.setsockopt(SOL_SOCKET, SO_SNDBUF, 256 * 1024)
+
         # Bind to a specific port
         self.server_socket.bind(('', port))
 
         # Listen for client knocking.
-        backlog = 10
-        self.server_socket.listen(backlog)
+        self.server_socket.listen(SOMAXCONN)
+
+    def stop(self):
+        """
+        Makes accept_connections_until_all_work_done shut the server down
+        right away, even if there's work left. Safe to call from any thread,
+        and does nothing once the server has shut down.
+        """
+
+        with self._wakeup_lock:
+            if not self._wakeup_closed:
+                os.write(self._wakeup_w, b's')
+
+    def _respond(self, request: Message) -> Message|None:
+        """
+        Processes the specified request from a Volunteer and returns the
+        response to send back, or None if the request isn't one a Volunteer
+        should send to the Coordinator.
+        """
+
+        if isinstance(request, GetWorkRequest):
+            if self.work_tracker.is_all_work_done():
+                return GetWorkResponse('', '')
+            return GetWorkResponse(self.work_tracker.play_download_host, self.work_tracker.get_path_for_volunteer())
+        if isinstance(request, WorkCompleteRequest):
+            was_all_work_done = self.work_tracker.is_all_work_done()
+            self.work_tracker.process_result(request.path, request.word_counts)
+            if not was_all_work_done and self.work_tracker.is_all_work_done():
+                # Wake up the accept loop so it starts winding down.
+                os.write(self._wakeup_w, b'x')
+            return WorkCompleteResponse()
+        return None
+
+    def _serve_connection(self, key: selectors.SelectorKey, mask: int):
+        """
+        Serves a connected Volunteer whose socket is ready for the specified
+        mask of events: reads what it has sent and answers each whole request
+        in it, then sends it as many of the responses as it will take. Closes
+        the connection once the Volunteer closes it (or sends an empty frame,
+        or anything that isn't a request).
+        """
+
+        connection_socket, connection = key.fileobj, key.data
+        if mask & selectors.EVENT_READ:
+            try:
+                data = connection_socket.recv(65536)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b""
+            if not data:
+                self._close_connection(connection_socket)
+                return
+            connection.received += data
+            self._answer_frames(connection)
 
-        self.server_socket.settimeout(.5)
-        return self.server_socket.getsockname()[1]
+        try:
+            sent = connection_socket.send(connection.unsent) if connection.unsent else 0
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._close_connection(connection_socket)
+            return
+        del connection.unsent[:sent]
+        if connection.unsent:
+            # Wait for the Volunteer to take the rest before reading more from
+            # it, so one that never reads can't hold up anyone else.
+            events = selectors.EVENT_WRITE
+        elif connection.done:
+            self._close_connection(connection_socket)
+            return
+        else:
+            events = selectors.EVENT_READ
+        if events != key.events:
+            self._sel.modify(connection_socket, events, connection)
+
+    def _answer_frames(self, connection: _Connection):
+        """
+        Answers each whole request in connection.received, adding the
+        responses to connection.unsent.
+        """
+
+        buf = connection.received
+        while not connection.done and len(buf) >= FRAME_HEADER_SIZE:
+            end = FRAME_HEADER_SIZE + int.from_bytes(buf[:FRAME_HEADER_SIZE], 'big')
+            if len(buf) < end:
+                break
+            frame = bytes(buf[FRAME_HEADER_SIZE:end])
+            del buf[:end]
+            try:
+                resp = self._respond(Message.deserialize(frame)) if frame else None
+            except ValueError:
+                resp = None
+            if resp is None:
+                connection.done = True
+            else:
+                resp.frame_into(connection.unsent)
+
+    def _close_connection(self, connection_socket: socket):
+        """
+        Stops waiting on the specified Volunteer connection and closes it.
+        """
+
+        self._sel.unregister(connection_socket)
+        connection_socket.close()
+
+    def _answer_datagram(self):
+        """
+        Answers a GetWorkRequest received on the UDP socket. Anything else
+        (including a malformed datagram) is dropped; a Volunteer that gets no
+        answer sends its request again.
+        """
+
+        try:
+            data, addr = self.udp_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            request = Message.deserialize(data)
+        except (OSError, ValueError):
+            # Includes BlockingIOError, and the ConnectionResetError Windows
+            # reports once a Volunteer that gave up has closed its socket.
+            return
+        if isinstance(request, GetWorkRequest):
+            resp = self._respond(request)
+            try:
+                self.udp_socket.sendto(resp.serialize().encode('ascii'), addr)
+            except OSError:
+                pass
 
     def accept_connections_until_all_work_done(self):
         """
@@ -152,29 +394,48 @@ class Coordinator:
         there's no more work to do.
         """
 
-        try:
-            while True:
-                connection_socket, addr = self.server_socket.accept()
-                with connection_socket.makefile('rw') as file:
-                    request = Message.deserialize(file)
-                    if isinstance(request, GetWorkRequest):
-                        if self.work_tracker.is_all_work_done():
-                            resp = GetWorkResponse('', '')
-                        else:
-                            resp = GetWorkResponse(self.work_tracker.play_download_host, self.work_tracker.get_path_for_volunteer())
-                    elif isinstance(request, WorkCompleteRequest):
-                        self.work_tracker.process_result(request.path, request.word_counts)
-                        resp = WorkCompleteResponse()
-                    else:
-                        continue
-                    file.write(resp.serialize())
-
-                connection_socket.close()
-        except TimeoutError:
-            pass
+        all_work_done = stopped = False
+        while not stopped:
+            # Block until a Volunteer connects or sends something. Once all the
+            # work is done, only wait for up to linger_timeout before shutting
+            # down.
+            events = self._sel.select(
+                timeout=self.linger_timeout if all_work_done else None)
+            if not events:
+                break
+            for key, mask in events:
+                if key.data is not None:
+                    self._serve_connection(key, mask)
+                    continue
+                if key.fileobj is self.udp_socket:
+                    self._answer_datagram()
+                    continue
+                if key.fileobj is not self.server_socket:
+                    if os.read(self._wakeup_r, 1) == b's':
+                        stopped = True
+                    all_work_done = True
+                    continue
+                try:
+                    connection_socket, addr = self.server_socket.accept()
+                except BlockingIOError:
+                    continue
+                connection_socket.setblocking(False)
+                connection_socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+                self._sel.register(connection_socket, selectors.EVENT_READ, _Connection())
 
+        # Hang up on the Volunteers still connected (they have nothing left to
+        # report once all the work is done), then stop accepting.
+        for key in list(self._sel.get_map().values()):
+            if key.data is not None:
+                self._close_connection(key.fileobj)
+        self._sel.close()
         self.server_socket.close()
-        print(self.work_tracker.get_word_counts_desc())
+        self.udp_socket.close()
+        with self._wakeup_lock:
+            self._wakeup_closed = True
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+        print(self.work_tracker.get_word_counts_desc(self.result_size))
 
 
 if __name__ == '__main__':
@@ -1,10 +1,28 @@
-from coordinator import *
-from messages import *
-from socket import *
+from coordinator import Coordinator, WorkTracker
+from messages import (MAX_DATAGRAM_SIZE, GetWorkRequest, GetWorkResponse, Message,
+                      WorkCompleteRequest, WorkCompleteResponse)
+from socket import AF_INET, SOCK_DGRAM, SOCK_STREAM, socket
 import threading
 import unittest
 
 
+class TestWorkTracker(unittest.TestCase):
+
+    def test_get_word_counts_desc(self):
+        """
+        Tests that the aggregate word-counts come out most frequent first,
+        and that top limits them to that many words.
+        """
+
+        work_tracker = WorkTracker()
+        path = work_tracker.get_path_for_volunteer()
+        work_tracker.process_result(path, {'romeo': 2, 'juliet': 3, 'rose': 1})
+        self.assertEqual(list(work_tracker.get_word_counts_desc().items()),
+                         [('juliet', 3), ('romeo', 2), ('rose', 1)])
+        self.assertEqual(list(work_tracker.get_word_counts_desc(2).items()),
+                         [('juliet', 3), ('romeo', 2)])
+
+
 class TestCoordinator(unittest.TestCase):
     """
     This test case starts a Coordinator server in another thread and runs tests
@@ -13,33 +31,135 @@ class TestCoordinator(unittest.TestCase):
 
     def setUp(self):
         """
-        Starts the Coordinator server on another thread.
+        Starts the Coordinator server on another thread and connects to it.
         """
 
-        coordinator = Coordinator()
-        self.port = coordinator.start(0)
+        self.coordinator = Coordinator()
+        self.port = self.coordinator.start(0)
         print("port: %d" % self.port)
         self.coordinator_thread = threading.Thread(
-            target=coordinator.accept_connections_until_all_work_done)
+            target=self.coordinator.accept_connections_until_all_work_done,
+            daemon=True)
         self.coordinator_thread.start()
         print("Coordinator server thread started")
 
+        self._conn = socket(AF_INET, SOCK_STREAM)
+        self._conn.connect(('localhost', self.port))
+        self._rfile = self._conn.makefile('rb', buffering=65536)
+
     def tearDown(self):
-        self.coordinator_thread.join()
+        self._rfile.close()
+        self._conn.close()
+        # Shut the Coordinator down even if a failed test left work undone.
+        self.coordinator.stop()
+        self.coordinator_thread.join(timeout=5)
 
     def send_request(self, request) -> Message:
         """
-        Connects to the Coordinator server and sends the specified request to
-        it. Returns the response from the server.
+        Sends the specified request to the Coordinator server over the
+        connection opened in setUp. Returns the response from the server.
+        """
+
+        self._conn.sendall(request.frame())
+        return Message.deserialize(Message.read_frame(self._rfile))
+
+    def send_datagram(self, request) -> Message:
+        """
+        Sends the specified request to the Coordinator server in a UDP datagram.
+        Returns the response from the server.
+        """
+
+        with socket(AF_INET, SOCK_DGRAM) as udp_socket:
+            udp_socket.settimeout(5)
+            udp_socket.sendto(request.serialize().encode(), ('localhost', self.port))
+            return Message.deserialize(udp_socket.recv(MAX_DATAGRAM_SIZE))
+
+    def test_all_work_completes_over_udp(self):
+        """
+        Repeatedly asks for work in a UDP datagram and then reports it done
+        over TCP. Continues until there is no work left.
+        """
+
+        finished_paths = set()
+        while True:
+            get_work_response = self.send_datagram(GetWorkRequest())
+            self.assertIsInstance(get_work_response, GetWorkResponse)
+            if get_work_response.path == "":
+                break
+            self.assertEqual(get_work_response.host, "www.gutenberg.org")
+            self.assertFalse(get_work_response.path in finished_paths)
+            work_complete_response = self.send_request(
+                WorkCompleteRequest(get_work_response.path, {'hello': 10}))
+            self.assertIsInstance(work_complete_response, WorkCompleteResponse)
+            finished_paths.add(get_work_response.path)
+        self.assertEqual(len(finished_paths), 8)
+
+    def test_idle_connections_do_not_block(self):
+        """
+        Opens more connections than the Coordinator used to have threads for
+        and leaves them idle, then does all the work over another connection.
+        The Coordinator must still answer it, and shut down once the work is
+        done without waiting for the idle connections to close.
+        """
+
+        idle = [socket(AF_INET, SOCK_STREAM) for _ in range(20)]
+        try:
+            for conn in idle:
+                conn.connect(('localhost', self.port))
+            while (response := self.send_request(GetWorkRequest())).path != "":
+                self.send_request(WorkCompleteRequest(response.path, {'hello': 1}))
+            self.coordinator_thread.join(timeout=5)
+            self.assertFalse(self.coordinator_thread.is_alive())
+        finally:
+            for conn in idle:
+                conn.close()
+
+    def test_connection_not_reading_does_not_block(self):
+        """
+        Pipelines requests over a connection until the Coordinator stops
+        taking them, without ever reading the responses. The Coordinator must
+        still answer other Volunteers.
+        """
+
+        with socket(AF_INET, SOCK_STREAM) as flooder:
+            flooder.connect(('localhost', self.port))
+            flooder.setblocking(False)
+            requests = GetWorkRequest().frame() * 10000
+            try:
+                while True:
+                    flooder.send(requests)
+            except BlockingIOError:
+                pass
+            self.assertIsInstance(self.send_datagram(GetWorkRequest()), GetWorkResponse)
+            while (response := self.send_request(GetWorkRequest())).path != "":
+                self.send_request(WorkCompleteRequest(response.path, {'hello': 1}))
+            self.coordinator_thread.join(timeout=5)
+            self.assertFalse(self.coordinator_thread.is_alive())
+
+    def test_unknown_path_is_ignored(self):
+        """
+        Reports a play that was never handed out. The report must be
+        acknowledged without being counted, and the work still completes.
+        """
+
+        response = self.send_request(WorkCompleteRequest("/nope", {'hello': 1}))
+        self.assertIsInstance(response, WorkCompleteResponse)
+        while (response := self.send_request(GetWorkRequest())).path != "":
+            self.send_request(WorkCompleteRequest(response.path, {'hello': 1}))
+        self.coordinator_thread.join(timeout=5)
+        self.assertFalse(self.coordinator_thread.is_alive())
+        self.assertEqual(self.coordinator.work_tracker.word_counts['hello'], 8)
+
+    def test_stop(self):
+        """
+        Tests that stop shuts the Coordinator down even with work left.
         """
 
-        connection_socket = socket(AF_INET, SOCK_STREAM)
-        connection_socket.connect(('localhost', self.port))
-        connection_socket.send(request.serialize().encode())
-        with connection_socket.makefile('r') as response_file:
-            response = Message.deserialize(response_file)
-        connection_socket.close()
-        return response
+        self.send_request(GetWorkRequest())
+        self.coordinator.stop()
+        self.coordinator_thread.join(timeout=5)
+        self.assertFalse(self.coordinator_thread.is_alive())
+        self.coordinator.stop()
 
     def test_all_work_completes(self):
         """
@@ -6,8 +6,10 @@ format that can be sent over the network.
 Also defines the deserialization when receiving each message type from the
 network.
 """
-from functools import cache
-from io import *
+from functools import lru_cache
+from io import BufferedIOBase, IOBase
+import re
+import sys
 from typing import Final
 from abc import abstractmethod
 
@@ -16,26 +18,44 @@ ENDL: Final[str] = "\r\n"
 Line terminator.
 """
 
+MAX_DATAGRAM_SIZE: Final[int] = 1500
+"""
+Largest message that may be sent as a single UDP datagram (without a length
+prefix) between a Volunteer and the Coordinator.
+"""
+
+FRAME_HEADER_SIZE: Final[int] = 4
+"""
+Size of the big-endian length that precedes every message sent between a
+Volunteer and the Coordinator. A length of 0 means the sender is done with the
+connection.
+"""
+
+
+_GET_RE: Final[re.Pattern] = re.compile(rb"GET (\S+) \S+\r\nHost: (\S+)\r\n")
+"""
+Matches the request line and Host header of a serialized HTTPGetRequest,
+capturing the path and the host.
+"""
+
+_ASGW_RE: Final[re.Pattern] = re.compile(rb"AsgW\r\nHost: (\S*)\r\nPath: (\S*)\r\n\r\n")
+"""
+Matches a whole serialized GetWorkResponse, capturing the host and the path.
+"""
+
+_SUBW_RE: Final[re.Pattern] = re.compile(rb"SubW\r\nPath: (\S+)\r\nWord-Counts:\r\n")
+"""
+Matches the lines of a serialized WorkCompleteRequest that precede the word
+counts, capturing the path.
+"""
+
 
 class Message:
     """
     Base class for every app message type.
     """
 
-    @staticmethod
-    @cache
-    def prefixes() -> dict:
-        """
-        Returns a mapping of serialized message prefix strings to their corresponding classes.
-        """
-
-        return {
-            "GET ": HTTPGetRequest,
-            "ReqW": GetWorkRequest,
-            "AsgW": GetWorkResponse,
-            "SubW": WorkCompleteRequest,
-            "AckW": WorkCompleteResponse
-        }
+    __slots__ = ()
 
     @abstractmethod
     def serialize(self) -> str:
@@ -44,27 +64,71 @@ class Message:
         can be sent over the network.
         """
 
+    def frame_into(self, buf: bytearray):
+        """
+        Appends the frame of this message (as returned by frame) to buf, so
+        that several messages can be sent with a single write.
+        """
+
+        payload = self.serialize().encode('ascii')
+        buf += len(payload).to_bytes(FRAME_HEADER_SIZE, 'big')
+        buf += payload
+
+    def frame(self) -> bytes:
+        """
+        Returns the ASCII-encoded serialization of this message preceded by its
+        length, ready to be sent over a Volunteer-Coordinator connection.
+        """
+
+        payload = self.serialize().encode('ascii')
+        return len(payload).to_bytes(FRAME_HEADER_SIZE, 'big') + payload
+
+    @staticmethod
+    def read_frame(rfile: BufferedIOBase) -> bytes:
+        """
+        Reads the next length-prefixed message (as sent by frame) from the
+        specified rfile (e.g. a socket's makefile('rb')) and returns its
+        serialization. Returns an empty bytes if the peer closed the connection
+        or sent an empty frame to say it's done, or raises a ValueError if the
+        connection is closed part way through a frame.
+        """
+
+        header = rfile.read(FRAME_HEADER_SIZE)
+        if not header: return b""
+        if len(header) < FRAME_HEADER_SIZE: raise ValueError("Connection closed mid-frame")
+        length = int.from_bytes(header, 'big')
+        frame = rfile.read(length)
+        if len(frame) < length: raise ValueError("Connection closed mid-frame")
+        return frame
+
     @classmethod
-    def deserialize(cls, msg: TextIOBase):
+    def deserialize(cls, msg: bytes | IOBase):
         """
-        Parses the specified msg and returns its deserialized Message object (or
-        raises a ValueError if the msg is not a valid serialization).
+        Parses the specified msg (either a serialized message, e.g. as returned
+        by read_frame, or a text or binary stream holding one) and returns its
+        deserialized Message object (or raises a ValueError if the msg is not a
+        valid serialization).
         """
 
-        firstline = msg.readline()
+        if not isinstance(msg, (bytes, bytearray, memoryview)):
+            # Read the stream in one go and parse it like a received frame.
+            msg = msg.read()
+            if isinstance(msg, str):
+                msg = msg.encode('ascii')
+        frame = bytes(msg)
 
-        for prefix, subclass in cls.prefixes().items():
-            if firstline.startswith(prefix):
-                return subclass.parse(firstline, msg)
-        raise ValueError(f"No recognized prefix found")
+        subclass = _DISPATCH.get(frame[:4])
+        if subclass is None: raise ValueError("No recognized prefix found")
+        return subclass.parse(frame)
 
     @staticmethod
     @abstractmethod
-    def parse(firstline: str, rest: TextIOBase):
+    def parse(frame: bytes):
         """
-        Parses the specified firstline and rest (of message) as an instance of a
-        specific subclass of Message. Returns the resulting Message object, or
-        raises a ValueError on parsing failure.
+        Parses the specified frame (a whole serialized message, including the
+        terminating blank line) as an instance of a specific subclass of
+        Message. Returns the resulting Message object, or raises a ValueError
+        on parsing failure.
         """
 
 
@@ -75,6 +139,8 @@ class HTTPGetRequest(Message):
     This is fully defined for you as an example.
     """
 
+    __slots__ = ('host', 'path')
+
     def __init__(self, host: str, path: str):
         """
         Creates an HTTPGetRequest for the specified host and path.
@@ -91,22 +157,14 @@ class HTTPGetRequest(Message):
                 f"{ENDL}")
 
     @staticmethod
-    def parse(firstline: str, rest: TextIOBase) -> Message:
+    def parse(frame: bytes) -> Message:
         """
-        Parses the specified firstline and rest (of message) and returns an
-        HTTPGetRequest (or raises a ValueError if the msg is not a valid
-        serialized HTTPGetRequest).
+        Parses the specified frame and returns an HTTPGetRequest (or raises a
+        ValueError if the msg is not a valid serialized HTTPGetRequest).
         """
 
-        if not firstline.startswith("GET "): raise ValueError("Bad prefix")
-        split = firstline.split()
-        if len(split) != 3: raise ValueError("Incorrect number of elements")
-        [_, path, _] = split
-        split = rest.readline().split()
-        if len(split) != 2: raise ValueError("Incorrect number of elements")
-        [name, value] = split
-        if not name == "Host:": raise ValueError("Unexpected field")
-        return HTTPGetRequest(value, path)
+        if not (match := _GET_RE.match(frame)): raise ValueError("Malformed HTTPGetRequest")
+        return HTTPGetRequest(match[2].decode('ascii'), match[1].decode('ascii'))
 
 
 class GetWorkRequest(Message):
@@ -114,21 +172,24 @@ class GetWorkRequest(Message):
     Message sent by a Volunteer to the Coordinator to ask for work.
     """
 
+    __slots__ = ()
+
+    _SERIALIZED: Final[str] = (f"ReqW{ENDL}"
+                               f"{ENDL}")
+
     # Override
     def serialize(self) -> str:
-        return (f"ReqW{ENDL}"
-                f"{ENDL}")
+        return self._SERIALIZED
 
     @staticmethod
-    def parse(firstline: str, rest: TextIOBase) -> Message:
+    def parse(frame: bytes) -> Message:
         """
-        Parses the specified firstline and rest (of message) and returns a
-        GetWorkRequest (or raises a ValueError if the msg is not a valid
-        serialized GetWorkRequest).
+        Parses the specified frame and returns a GetWorkRequest (or raises a
+        ValueError if the msg is not a valid serialized GetWorkRequest).
         """
 
-        if not firstline.startswith("ReqW"): raise ValueError("Bad prefix")
-        return GetWorkRequest()
+        if not frame.startswith(b"ReqW"): raise ValueError("Bad prefix")
+        return _GET_WORK_REQUEST
 
 
 class GetWorkResponse(Message):
@@ -137,6 +198,8 @@ class GetWorkResponse(Message):
     Volunteer's GetWorkRequest.
     """
 
+    __slots__ = ('host', 'path')
+
     def __init__(self, host: str, path: str):
         """
         Constructs a response identifying a Shakespeare play (via the path) to
@@ -154,24 +217,33 @@ class GetWorkResponse(Message):
                 f"Path: {self.path}{ENDL}"
                 f"{ENDL}")
 
+    # Override
+    def frame_into(self, buf: bytearray):
+        buf += _frame_get_work_response(self.host, self.path)
+
+    # Override
+    def frame(self) -> bytes:
+        return _frame_get_work_response(self.host, self.path)
+
     @staticmethod
-    def parse(firstline: str, rest: TextIOBase) -> Message:
+    def parse(frame: bytes) -> Message:
         """
-        Parses the specified firstline and rest (of message) and returns a
-        GetWorkResponse (or raises a ValueError if the msg is not a valid
-        serialized GetWorkResponse).
+        Parses the specified frame and returns a GetWorkResponse (or raises a
+        ValueError if the msg is not a valid serialized GetWorkResponse).
         """
 
-        if not firstline.startswith("AsgW"): raise ValueError("Bad prefix")
+        if not (match := _ASGW_RE.match(frame)): raise ValueError("Malformed GetWorkResponse")
+        return GetWorkResponse(match[1].decode('ascii'), match[2].decode('ascii'))
+
+
+@lru_cache(maxsize=64)
+def _frame_get_work_response(host: str, path: str) -> bytes:
+    """
+    Returns the frame of a GetWorkResponse for the specified host and path.
+    Cached, since the Coordinator only ever hands out a few distinct plays.
+    """
 
-        args = []
-        for expected_name in ("Host:", "Path:"):
-            split = rest.readline().split()
-            if not split: raise ValueError("Incorrect number of elements")
-            name, value = split[0], split[1] if len(split) > 1 else ""
-            if name != expected_name: raise ValueError("Unexpected field")
-            args.append(value)
-        return GetWorkResponse(*args)
+    return Message.frame(GetWorkResponse(host, path))
 
 
 class WorkCompleteRequest(Message):
@@ -181,6 +253,8 @@ class WorkCompleteRequest(Message):
     assigned to the Volunteer in response to a GetWorkRequest.
     """
 
+    __slots__ = ('path', 'word_counts')
+
     def __init__(self, path: str, word_counts: dict):
         """
         Constructs a WorkCompleteRequest reporting the word-frequency result
@@ -193,37 +267,36 @@ class WorkCompleteRequest(Message):
 
     # Override
     def serialize(self) -> str:
-        return (f"SubW{ENDL}"
-                f"Path: {self.path}{ENDL}"
-                f"Word-Counts:{ENDL}" +
-                "".join(f"{word} {count}{ENDL}" for word, count in self.word_counts.items()) +
-                f"{ENDL}")
+        buf = [f"SubW{ENDL}", f"Path: {self.path}{ENDL}", f"Word-Counts:{ENDL}"]
+        append = buf.append
+        for word, count in self.word_counts.items():
+            append(word)
+            append(" ")
+            append(str(count))
+            append(ENDL)
+        append(ENDL)
+        return "".join(buf)
 
     @staticmethod
-    def parse(firstline: str, rest: TextIOBase) -> Message:
+    def parse(frame: bytes) -> Message:
         """
-        Parses the specified firstline and rest (of message) and returns a
-        WorkCompleteRequest (or raises a ValueError if the msg is not a
-        valid serialized WorkCompleteRequest).
+        Parses the specified frame and returns a WorkCompleteRequest (or raises
+        a ValueError if the msg is not a valid serialized WorkCompleteRequest).
         """
 
-        if not firstline.startswith("SubW"): raise ValueError("Bad prefix")
-
-        split = rest.readline().split()
-        if len(split) != 2: raise ValueError("Incorrect number of elements")
-        name, path = split[0], split[1]
-        if not name == "Path:": raise ValueError("Unexpected field")
+        if not (match := _SUBW_RE.match(frame)): raise ValueError("Malformed WorkCompleteRequest")
+        path = match[1]
 
-        split = rest.readline().split()
-        if len(split) != 1: raise ValueError("Incorrect number of elements")
-        name = split[0]
-        if name != "Word-Counts:": raise ValueError("Unexpected field")
+        # The counts end at the first blank line; the search starts at the end
+        # of the Word-Counts line so that an empty list of counts is found too.
+        end = frame.find(b"\r\n\r\n", match.end() - 2)
+        if end < 0: raise ValueError("Missing terminating blank line")
 
-        word_counts = {}
-        while len(split := rest.readline().split()) > 0:
-            if len(split) != 2: raise ValueError("Incorrect number of elements")
-            word_counts[split[0]] = int(split[1])
-        return WorkCompleteRequest(path, word_counts)
+        # Unpacking raises a ValueError for any line without exactly two
+        # elements.
+        pairs = [line.split() for line in frame[match.end():end].splitlines()]
+        word_counts = {word.decode('ascii'): int(count) for word, count in pairs}
+        return WorkCompleteRequest(sys.intern(path.decode('ascii')), word_counts)
 
 
 class WorkCompleteResponse(Message):
@@ -232,18 +305,45 @@ class WorkCompleteResponse(Message):
     WorkCompleteRequest.
     """
 
+    __slots__ = ()
+
+    _SERIALIZED: Final[str] = (f"AckW{ENDL}"
+                               f"{ENDL}")
+
     # Override
     def serialize(self) -> str:
-        return (f"AckW{ENDL}"
-                f"{ENDL}")
+        return self._SERIALIZED
 
     @staticmethod
-    def parse(firstline: str, rest: TextIOBase) -> Message:
+    def parse(frame: bytes) -> Message:
         """
-        Parses the specified firstline and rest (of message) and returns a
-        WorkCompleteResponse (or raises a ValueError if the msg is not a
-        valid serialized WorkCompleteResponse).
+        Parses the specified frame and returns a WorkCompleteResponse (or
+        raises a ValueError if the msg is not a valid serialized
+        WorkCompleteResponse).
         """
 
-        if not firstline.startswith("AckW"): raise ValueError("Bad prefix")
-        return WorkCompleteResponse()
+        if not frame.startswith(b"AckW"): raise ValueError("Bad prefix")
+        return _WORK_COMPLETE_RESPONSE
+
+
+_GET_WORK_REQUEST: Final[GetWorkRequest] = GetWorkRequest()
+"""
+The GetWorkRequest returned by every parse, since they carry no state.
+"""
+
+_WORK_COMPLETE_RESPONSE: Final[WorkCompleteResponse] = WorkCompleteResponse()
+"""
+The WorkCompleteResponse returned by every parse, since they carry no state.
+"""
+
+_DISPATCH: Final[dict] = {
+    b"GET ": HTTPGetRequest,
+    b"ReqW": GetWorkRequest,
+    b"AsgW": GetWorkResponse,
+    b"SubW": WorkCompleteRequest,
+    b"AckW": WorkCompleteResponse
+}
+"""
+Mapping of serialized message prefixes (the first four characters of a
+message) to their corresponding classes.
+"""
@@ -1,18 +1,47 @@
 """Tests for messages.py."""
 
+from io import StringIO
+from socket import socketpair
 import unittest
 
-from messages import *
+from messages import (GetWorkRequest, GetWorkResponse, HTTPGetRequest, Message,
+                      WorkCompleteRequest, WorkCompleteResponse)
 
 
 class TestMessage(unittest.TestCase):
 
     def test_invalid_deserialize(self):
-        try:
-            Message.deserialize(StringIO("bogus msg"))
-            self.fail("Expected ValueError")
-        except ValueError:
-            pass
+        for cls in (Message, HTTPGetRequest, GetWorkRequest, GetWorkResponse,
+                    WorkCompleteRequest, WorkCompleteResponse):
+            with self.subTest(cls=cls), self.assertRaises(ValueError):
+                cls.deserialize(StringIO("bogus msg"))
+
+    def test_frame_read_frame(self):
+        """
+        Tests that a framed message is received whole by read_frame, even when
+        it arrives in pieces, and that the end of the connection is reported
+        as an empty frame.
+        """
+
+        framed = GetWorkResponse("some-host", "some-path").frame()
+        self.assertEqual(framed, b"\x00\x00\x00\x2a"
+                                 b"AsgW\r\nHost: some-host\r\n"
+                                 b"Path: some-path\r\n\r\n")
+
+        sender, receiver = socketpair()
+        with sender, receiver:
+            sender.sendall(framed[:2])
+            sender.sendall(framed[2:20])
+            sender.sendall(framed[20:])
+            with receiver.makefile('rb') as rfile:
+                frame = Message.read_frame(rfile)
+                sender.close()
+                self.assertEqual(Message.read_frame(rfile), b"")
+
+        deserialized = Message.deserialize(frame)
+        self.assertIsInstance(deserialized, GetWorkResponse)
+        self.assertEqual(deserialized.host, "some-host")
+        self.assertEqual(deserialized.path, "some-path")
 
 
 class TestHTTPGetRequest(unittest.TestCase):
@@ -106,6 +135,20 @@ class TestWorkCompleteRequest(unittest.TestCase):
         self.assertEqual(deserialized.path, "path-to-play")
         self.assertEqual(deserialized.word_counts, {"romeo": 16, "juliet": 18, "rose": 7})
 
+    def test_deserialize_stops_at_blank_line(self):
+        """
+        Tests that the word counts end at the first blank line, and that a
+        message without one is rejected.
+        """
+
+        header = b"SubW\r\nPath: path-to-play\r\nWord-Counts:\r\n"
+        deserialized = Message.deserialize(header + b"romeo 1\r\n\r\njunk 5\r\n")
+        self.assertEqual(deserialized.word_counts, {"romeo": 1})
+        deserialized = Message.deserialize(header + b"\r\n")
+        self.assertEqual(deserialized.word_counts, {})
+        with self.assertRaises(ValueError):
+            Message.deserialize(header + b"romeo 1\r\n")
+
 
 class TestWorkCompleteResponse(unittest.TestCase):
 
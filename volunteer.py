@@ -1,6 +1,28 @@
-from messages import *
-from socket import *
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from messages import (MAX_DATAGRAM_SIZE, GetWorkRequest, GetWorkResponse,
+                      HTTPGetRequest, Message, WorkCompleteRequest,
+                      WorkCompleteResponse)
+from socket import (AF_INET, IPPROTO_TCP, SOCK_DGRAM, SOCK_STREAM, TCP_NODELAY,
+                    getaddrinfo, socket)
+import re
 import ssl
+from string import ascii_letters
+
+_WORD_RE = re.compile(rb"[A-Za-z]{6,}")
+"""
+Matches the words that do_work counts: runs of more than 5 ASCII letters.
+"""
+
+_LETTERS = ascii_letters.encode('ascii')
+"""
+The letters _WORD_RE matches words of, as bytes.
+"""
+
+_CONTENT_LENGTH_RE = re.compile(rb"\r\nContent-Length:[ \t]*(\d+)", re.IGNORECASE)
+"""
+Matches the Content-Length header of an HTTP response, capturing its value.
+"""
 
 class Volunteer:
     """
@@ -17,105 +39,277 @@ class Volunteer:
         self.coordinator_host = coordinator_host
         self.coordinator_port = coordinator_port
 
+        self.retransmit_timeout = .2
+        """
+        Seconds to wait for the Coordinator to answer a GetWorkRequest datagram
+        before sending it again.
+        """
+
+        self.max_get_work_attempts = 5
+        """
+        Number of times to send a GetWorkRequest datagram before giving up on
+        the Coordinator.
+        """
+
+        self.max_downloads = 4
+        """
+        Number of plays to download and analyze at the same time.
+        """
+
+        self._coord_sock = None
+        """
+        TCP connection to the Coordinator, kept open across requests, or None
+        if not connected.
+        """
+
+        self._coord_reader = None
+        """
+        Buffered binary reader of responses from _coord_sock.
+        """
+
+        self._ssl_context = ssl.create_default_context()
+        """
+        TLS settings shared by every download, so that the sessions in
+        _tls_sessions can be resumed.
+        """
+
+        self._tls_sessions = {}
+        """
+        The last TLS session established with each web-service host, used to
+        skip the full handshake on the next download from it.
+        key: host, value: ssl.SSLSession.
+        """
+
+        self._addresses = {}
+        """
+        Resolved address of each web-service host downloaded from during the
+        current keep_working_until_done, so that DNS is only asked once.
+        key: host, value: (IPv4 address, port).
+        """
+
     def connect(self) -> socket|None:
         """
-        Connects to the Coordinator using TCP on IPv4 and returns the connection
-        socket.
+        Connects to the Coordinator using TCP on IPv4, unless already
+        connected, and returns the connection socket (or None if the
+        Coordinator refused the connection).
         """
 
+        if self._coord_sock:
+            return self._coord_sock
         sock = socket(AF_INET, SOCK_STREAM)
+        # Requests are small and written whole, so don't let Nagle's algorithm
+        # hold them back waiting for a delayed ACK.
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
         try:
             sock.connect((self.coordinator_host, self.coordinator_port))
         except ConnectionRefusedError:
             sock.close()
             return None
+        self._coord_sock = sock
+        self._coord_reader = sock.makefile('rb')
         return sock
+
+    def close(self):
+        """
+        Closes the connection to the Coordinator, if any.
+        """
+
+        if self._coord_sock:
+            self._coord_reader.close()
+            self._coord_sock.close()
+            self._coord_sock = self._coord_reader = None
     
     def get_work(self) -> GetWorkResponse|None:
         """
-        Connects to the Coordinator, asks for work, and returns the response.
+        Asks the Coordinator for work in a UDP datagram and returns the
+        response, resending the request whenever an answer takes too long.
+        Returns None if the Coordinator doesn't answer.
         """
-        sock = self.connect()
-        if not sock:
-            return None
-        sock.send(GetWorkRequest().serialize().encode())
-        with sock.makefile('r') as response_file:
-            response = Message.deserialize(response_file)
 
-        sock.close()
-        return response
+        request = GetWorkRequest().serialize().encode('ascii')
+        with socket(AF_INET, SOCK_DGRAM) as sock:
+            sock.settimeout(self.retransmit_timeout)
+            sock.connect((self.coordinator_host, self.coordinator_port))
+            for _ in range(self.max_get_work_attempts):
+                try:
+                    sock.send(request)
+                    return Message.deserialize(sock.recv(MAX_DATAGRAM_SIZE))
+                except TimeoutError:
+                    continue
+                except ConnectionRefusedError:
+                    break
+        return None
 
     
     def do_work(self, get_work_response: GetWorkResponse) -> dict:
         """
         Performs the work denoted by get_work_response and returns the
         word-counts. This is a simple implementation that counts all words
-        that have more than 5 characters. You don't need to modify this and can
-        use it as is.
+        (runs of ASCII letters, case-insensitively) that have more than 5
+        letters.
         """
     
-        context = ssl.create_default_context()
+        host = get_work_response.host
         download_socket = socket(AF_INET, SOCK_STREAM)
-        download_socket = context.wrap_socket(
-            download_socket, server_hostname=get_work_response.host)
+        download_socket = self._ssl_context.wrap_socket(
+            download_socket, server_hostname=host,
+            session=self._tls_sessions.get(host))
         
-        port = 443
-        download_socket.connect((gethostbyname(get_work_response.host), port))
+        if (address := self._addresses.get(host)) is None:
+            port = 443
+            address = getaddrinfo(host, port, AF_INET, SOCK_STREAM)[0][4]
+            self._addresses[host] = address
+        download_socket.connect(address)
         request = HTTPGetRequest(get_work_response.host, get_work_response.path)
         download_socket.send(request.serialize().encode())
 
-        word_counts = dict()
-        with download_socket.makefile('r') as f:
-            while True:
-                # Read a line from the socket
-                line = f.readline()
-                if len(line) == 0:
-                    break
-                words = line.split()
-                for word in words:
-                    if len(word) > 5:
-                        word = word.lower()
-                        word_counts[word] = word_counts.get(word, 0) + 1
+        word_counts = self._count_words(download_socket)
+        # With TLS 1.3 the session ticket only arrives after the handshake, so
+        # take the session once the download has been read.
+        if download_socket.session is not None:
+            self._tls_sessions[host] = download_socket.session
         download_socket.close()
-        sorted_words = dict(sorted(word_counts.items(),
-                                   key=lambda item: item[1],
-                                   reverse=True)[:20])
+        sorted_words = {word.decode('ascii'): count
+                        for word, count in word_counts.most_common(20)}
         print(sorted_words)
         return sorted_words
     
-    def report_work(self, path: str, result: dict) -> WorkCompleteResponse|None:
+    @staticmethod
+    def _count_words(download_socket: socket, chunk_size: int = 65536) -> Counter:
         """
-        Connects to the Coordinator and reports the results of a previously
-        completed analysis of a play.
+        Receives an HTTP response from download_socket, chunk_size bytes at a
+        time, and returns the counts of the words (lowercased) in its body.
+        """
+
+        # Count words a chunk at a time. A word may be split across two chunks,
+        # so the letters at the end of a chunk are carried over to the next one.
+        # Stop at the end of the body when its length is known, rather than
+        # wait for the server to close the (HTTP/1.1 keep-alive) connection.
+        word_counts = Counter()
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        data, remaining = Volunteer._receive_response_head(download_socket, buf)
+        tail = b""
+        while True:
+            if remaining is not None:
+                data = data[:remaining]
+                remaining -= len(data)
+            chunk = tail + data
+            end = len(chunk.rstrip(_LETTERS))
+            tail = chunk[end:]
+            word_counts.update(map(bytes.lower, _WORD_RE.findall(chunk, 0, end)))
+            if remaining == 0 or not (received := download_socket.recv_into(buf)):
+                break
+            data = view[:received]
+        if len(tail) > 5:
+            word_counts[tail.lower()] += 1
+        return word_counts
+
+    @staticmethod
+    def _receive_response_head(download_socket: socket, buf: bytearray) -> tuple:
+        """
+        Receives (into buf) the status line and headers of an HTTP response
+        from download_socket. Returns the start of the body that was received
+        along with them, and the length of the whole body (or None if the
+        response doesn't give a Content-Length).
+        """
+
+        view = memoryview(buf)
+        received = b""
+        while (end := received.find(b"\r\n\r\n")) < 0:
+            count = download_socket.recv_into(buf)
+            if count == 0:
+                # The connection closed before the headers ended: no body.
+                return b"", 0
+            received += view[:count]
+        match = _CONTENT_LENGTH_RE.search(received, 0, end)
+        return received[end + 4:], int(match[1]) if match else None
+
+    def _exchange(self, *requests: Message) -> list|None:
+        """
+        Sends the specified requests to the Coordinator back-to-back over the
+        (possibly already open) connection, then reads one response to each.
+        Returns the responses in order, or None if the Coordinator can't be
+        reached.
         """
 
         sock = self.connect()
         if not sock:
             return None
-        sock.send(WorkCompleteRequest(path, result).serialize().encode())
-        with sock.makefile('r') as response_file:
-            response = Message.deserialize(response_file)
+        try:
+            buf = bytearray()
+            for request in requests:
+                request.frame_into(buf)
+            sock.sendall(buf)
+            return [Message.deserialize(Message.read_frame(self._coord_reader))
+                    for _ in requests]
+        except (OSError, ValueError):
+            # The Coordinator closed the connection (or sent garbage).
+            self.close()
+            return None
+
+    def report_work(self, path: str, result: dict) -> WorkCompleteResponse|None:
+        """
+        Reports the results of a previously completed analysis of a play to
+        the Coordinator (connecting to it if needed) and returns the response,
+        or None if the Coordinator can't be reached.
+        """
 
-        sock.close()
-        return response
+        responses = self._exchange(WorkCompleteRequest(path, result))
+        return responses[0] if responses else None
+
+    def report_work_and_get_work(self, path: str, result: dict) -> GetWorkResponse|None:
+        """
+        Reports the results of a previously completed analysis of a play to
+        the Coordinator and, without waiting for the acknowledgement, asks
+        for more work on the same connection. Returns the response to the
+        request for work, or None if the report wasn't acknowledged.
+        """
+
+        responses = self._exchange(WorkCompleteRequest(path, result),
+                                   GetWorkRequest())
+        if not responses or not isinstance(responses[0], WorkCompleteResponse):
+            return None
+        return responses[1]
 
     def keep_working_until_done(self):
         """
         Repeatedly asks for work from the Coordinator, performs the work, and
-        reports the results. Continues until the Coordinator responds with no
-        work or there's an error talking to the Coordinator.
+        reports the results, working on up to max_downloads plays at a time.
+        Continues until the Coordinator responds with no work or there's an
+        error talking to the Coordinator.
         """
-        
 
-        while True:
-            work = self.get_work()
-            if not isinstance(work, GetWorkResponse) or work.host == '' or work.path == '':
-                break
-            result = self.do_work(work)
-            if not self.report_work(work.path, result):
-                break
+        self._addresses.clear()
+        # Futures of the do_work calls in progress, mapped to their paths.
+        in_flight = {}
+
+        def is_new_work(work) -> bool:
+            # The Coordinator hands out already started plays once none are
+            # left unstarted; there's no point downloading one twice here.
+            return (isinstance(work, GetWorkResponse) and work.host != ''
+                    and work.path != '' and work.path not in in_flight.values())
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_downloads) as pool:
+                while len(in_flight) < self.max_downloads:
+                    work = self.get_work()
+                    if not is_new_work(work):
+                        break
+                    in_flight[pool.submit(self.do_work, work)] = work.path
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = in_flight.pop(future)
+                        # Ask for the next play along with the report, saving
+                        # a round trip per play.
+                        work = self.report_work_and_get_work(path, future.result())
+                        if is_new_work(work):
+                            in_flight[pool.submit(self.do_work, work)] = work.path
+        finally:
+            self.close()
+
 
-    
 if __name__ == '__main__':
     volunteer = Volunteer('localhost', 5791)
     volunteer.keep_working_until_done()
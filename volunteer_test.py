@@ -1,10 +1,11 @@
-from coordinator import *
-from messages import *
-import random
-from socket import *
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from coordinator import Coordinator
+import re
+from socket import socketpair
 import threading
 import unittest
-from volunteer import *
+from volunteer import Volunteer
 
 class TestVolunteer(unittest.TestCase):
     """
@@ -12,37 +13,100 @@ class TestVolunteer(unittest.TestCase):
     against it.
     """
 
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         """
-        Starts the Coordinator server on another thread.
+        Starts the Coordinator server on another (daemon) thread, once for the
+        whole test case.
         """
         
-        coordinator = Coordinator()
-        self.port = coordinator.start(0)
-        print("port: %d" % self.port)
-        self.coordinator_thread = threading.Thread(
-            target=coordinator.accept_connections_until_all_work_done)
-        self.coordinator_thread.start()
+        cls.coordinator = Coordinator()
+        cls.port = cls.coordinator.start(0)
+        print("port: %d" % cls.port)
+        cls.coordinator_thread = threading.Thread(
+            target=cls.coordinator.accept_connections_until_all_work_done,
+            daemon=True)
+        cls.coordinator_thread.start()
         print("Coordinator server thread started")
-        
-    def tearDown(self):
-        self.coordinator_thread.join()
 
     def test_all_work_completes(self):
         """
         Creates two Volunteers and runs each one in parallel in its own thread
         until all the work is done.
         """
-        volunteer1 = Volunteer('localhost', self.port)
-        self.volunteer1_thread = threading.Thread(
-            target=volunteer1.keep_working_until_done)
-        self.volunteer1_thread.start()
-        volunteer2 = Volunteer('localhost', self.port)
-        self.volunteer2_thread = threading.Thread(
-            target=volunteer2.keep_working_until_done)
-        self.volunteer2_thread.start()
-        self.volunteer1_thread.join()
-        self.volunteer2_thread.join()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(Volunteer('localhost', self.port).keep_working_until_done)
+                       for _ in range(2)]
+        for future in futures:
+            future.result()
+        # The thread is a daemon, so don't wait forever if the Coordinator
+        # never sees all the work done (e.g. the Volunteers gave up early).
+        self.coordinator_thread.join(timeout=10)
+        self.assertFalse(self.coordinator_thread.is_alive())
+        self.assertEqual(len(self.coordinator.work_tracker.finished_paths), 8)
+
+
+class TestCountWords(unittest.TestCase):
+    """
+    Tests the counting of words in a downloaded play, offline, by feeding
+    canned HTTP responses through a socketpair.
+    """
+
+    BODY = (b"Two households, both alike in dignity,\r\n"
+            b"In fair Verona, where we lay our scene,\r\n"
+            b"From ancient grudge break to new mutiny,\r\n"
+            b"Where civil blood makes civil hands unclean. HOUSEHOLDS Verona")
+
+    def count_words(self, pieces: list, close: bool) -> Counter:
+        """
+        Sends the specified pieces of a response one at a time, closing the
+        sending end afterwards if close is specified, and returns the word
+        counts of it, received a few bytes at a time.
+        """
+
+        sender, receiver = socketpair()
+        with sender, receiver:
+            # Fail rather than hang if the counting reads past the body.
+            receiver.settimeout(5)
+            for piece in pieces:
+                sender.sendall(piece)
+            if close:
+                sender.close()
+            return Volunteer._count_words(receiver, chunk_size=7)
+
+    def expected_counts(self) -> Counter:
+        return Counter(map(bytes.lower, re.findall(rb"[A-Za-z]{6,}", self.BODY)))
+
+    def test_stops_at_content_length(self):
+        """
+        Tests that words split across chunks are counted whole, and that the
+        body ends at its Content-Length even though the connection stays open.
+        """
+
+        response = (b"HTTP/1.1 200 OK\r\n"
+                    b"content-length: %d\r\n"
+                    b"\r\n" % len(self.BODY) + self.BODY + b"trailing garbage")
+        pieces = [response[i:i + 5] for i in range(0, len(response), 5)]
+        self.assertEqual(self.count_words(pieces, close=False), self.expected_counts())
+
+    def test_reads_until_closed(self):
+        """
+        Tests that a body without a Content-Length is read until the server
+        closes the connection, including a word that ends the body.
+        """
+
+        response = b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n" + self.BODY
+        self.assertEqual(self.count_words([response], close=True), self.expected_counts())
+
+    def test_closed_before_headers(self):
+        sender, receiver = socketpair()
+        with sender, receiver:
+            sender.sendall(b"HTTP/1.1 200 OK\r\nContent-Len")
+            sender.close()
+            self.assertEqual(Volunteer._receive_response_head(receiver, bytearray(7)),
+                             (b"", 0))
+        self.assertEqual(self.count_words([b"HTTP/1.1 200 OK\r\n"], close=True), Counter())
+
 
 if __name__ == '__main__':
     unittest.main()    